@@ -19,7 +19,11 @@
 """ A code completion parser for Python """
 
 from io import StringIO
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import os
 import tokenize
+import time
 import keyword
 import builtins
 
@@ -32,6 +36,7 @@ class ScopeType:
 
 KEYWORDS_THAT_INHERIT_SCOPE = [ "if", "else", "for", "elif", "try", "except", "do", "while", "with" ]
 KEYWORDS_THAT_ARE_IGNORED = [ "raise", "assert", "break", "continue", "throw", "print", "pass", "return" ]
+BUILTIN_NAMES = set(dir(builtins)) | set(keyword.kwlist)
 
 class Scope(object):
     def __init__(self, name, scope_type, parent=None):
@@ -45,13 +50,23 @@ class Scope(object):
         self.keywords = set()
         
         if scope_type == ScopeType.MODULE:
-            self.methods = set([ x for x in dir(builtins) if __builtins__.get(x).__class__ == isinstance.__class__ ])
-            self.types = set([ x for x in dir(builtins) if isinstance(__builtins__.get(x), type) ])
+            self.methods = set([ x for x in dir(builtins) if getattr(builtins, x).__class__ == isinstance.__class__ ])
+            self.types = set([ x for x in dir(builtins) if isinstance(getattr(builtins, x), type) ])
             self.keywords = set(keyword.kwlist)
         self.modules = set()
         self.inherited_scopes = set()
 
+        #For classes, the names of the base classes as written, and the
+        #scopes they resolve to. The MRO is filled in once per parse.
+        self.base_names = []
+        self.bases = []
+        self.mro = None
+
         self.children = {}
+
+        #Filled in by the parser for classes and methods, used to describe proposals
+        self.line_no = None
+        self.arguments = []
         
     def inherit(self, scope):
         import copy
@@ -62,29 +77,26 @@ class Scope(object):
         for scope in self.inherited_scopes:
             if isinstance(scope, Scope):
                 result.extend(scope.get_variables())
-            else:
-                #FIXME: look up class scope
-                pass
+        for scope in self.get_mro()[1:]:
+            result.extend(scope.variables)
         return set(result)
     
     def get_methods(self):
         result = list(self.methods)
         for scope in self.inherited_scopes:
-            if isinstance(scope, Scope):        
+            if isinstance(scope, Scope):
                 result.extend(scope.get_methods())
-            else:
-                #FIXME: look up class scope
-                pass                
+        for scope in self.get_mro()[1:]:
+            result.extend(scope.methods)
         return set(result)
     
     def get_types(self):
         result = list(self.types)
         for scope in self.inherited_scopes:
-            if isinstance(scope, Scope):        
+            if isinstance(scope, Scope):
                 result.extend(scope.get_types())
-            else:
-                #FIXME: look up class scope
-                pass                
+        for scope in self.get_mro()[1:]:
+            result.extend(scope.types)
         return set(result)        
 
     def get_modules(self):
@@ -92,9 +104,12 @@ class Scope(object):
         for scope in self.inherited_scopes:
             if isinstance(scope, Scope):
                 result.extend(scope.get_modules())
-            else:
-                pass
+        for scope in self.get_mro()[1:]:
+            result.extend(scope.modules)
         return set(result)
+
+    def get_mro(self):
+        return self.mro or [ self ]
     
 class ObjectScope(Scope):
     def __init__(self, parent):
@@ -163,15 +178,210 @@ class DictScope(Scope):
         
         self.variables = set(variables)
         self.methods = set(methods)
+
+#Builtin types that a class can inherit from, object is left out so that
+#its dunder methods don't swamp the completions of every class
+BUILTIN_CLASS_SCOPES = {
+    "list" : ListScope,
+    "tuple" : TupleScope,
+    "int" : IntScope,
+    "str" : StrScope,
+    "dict" : DictScope
+}
                 
-                
+class IdentifierIndex(object):
+    """
+        An inverted index from identifier to the documents that define it,
+        shared by all of the open documents. Each document is updated with
+        the difference from its last parse, and the identifiers are kept
+        sorted so that prefix lookups are a bisect rather than a scan.
+    """
+    def __init__(self):
+        self._documents = {}
+        self._postings = {}
+        self._sorted = []
+
+    def update(self, document, names):
+        old_names = self._documents.get(document, set())
+        names = set(names)
+
+        for name in old_names - names:
+            documents = self._postings[name]
+            documents.discard(document)
+            if not documents:
+                del self._postings[name]
+                del self._sorted[bisect_left(self._sorted, name)]
+
+        for name in names - old_names:
+            if name not in self._postings:
+                self._postings[name] = set()
+                insort(self._sorted, name)
+            self._postings[name].add(document)
+
+        self._documents[document] = names
+
+    def remove(self, document):
+        if document in self._documents:
+            self.update(document, ())
+            del self._documents[document]
+
+    def get_documents(self, name):
+        return set(self._postings.get(name, ()))
+
+    def find(self, prefix, exclude=None):
+        """ Returns the identifiers starting with prefix that are defined outside of exclude """
+        result = []
+        i = bisect_left(self._sorted, prefix)
+        while i < len(self._sorted) and self._sorted[i].startswith(prefix):
+            name = self._sorted[i]
+            if self._postings[name] - set([exclude]):
+                result.append(name)
+            i += 1
+        return result
+
+class TokenCache(object):
+    """
+        Caches the tokens of each logical line, keyed by the text of the
+        line it starts on. A logical line always starts with the tokenizer
+        in its ground state (no open bracket, backslash continuation or
+        unterminated string), so the lines inside a bracket, continuation
+        or multi-line string are cached along with the line that starts
+        them. INDENT and DEDENT depend on the lines before, so they are
+        left out of the cache and generated again when the tokens are
+        replayed. Only lines that changed since the last parse are passed
+        to tokenize.
+    """
+    TAB_SIZE = 8
+
+    def __init__(self, max_size=10000):
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _tokenize_logical_line(self, lines, start):
+        position = [ start ]
+        def readline():
+            if position[0] >= len(lines):
+                return ""
+            line = lines[position[0]]
+            position[0] += 1
+            return line
+
+        tokens = []
+        depth = 0
+        for tok_type, token, (srow, scol), (erow, ecol), line in tokenize.generate_tokens(readline):
+            if tok_type in (tokenize.INDENT, DEDENT):
+                continue
+            if tok_type == tokenize.ENDMARKER:
+                return tokens, len(lines) - start
+
+            #Store rows relative to the start of the logical line
+            tokens.append((tok_type, token, (srow - 1, scol), (erow - 1, ecol), line))
+
+            #Like tokenize, a stray closing bracket leaves the depth negative
+            #and the tokenizer doesn't return to its ground state
+            if tok_type == tokenize.OP and token in ("(", "[", "{"):
+                depth += 1
+            elif tok_type == tokenize.OP and token in (")", "]", "}"):
+                depth -= 1
+            elif tok_type in (NEWLINE, tokenize.NL) and depth == 0:
+                return tokens, srow
+
+        return tokens, len(lines) - start
+
+    def _get_logical_line(self, lines, start):
+        entry = self._entries.get(lines[start])
+        if entry:
+            continuation, tokens = entry
+            if continuation == tuple(lines[start + 1:start + 1 + len(continuation)]):
+                self._entries.move_to_end(lines[start])
+                self.hits += len(continuation) + 1
+                return tokens, len(continuation) + 1
+
+        tokens, line_count = self._tokenize_logical_line(lines, start)
+        self.misses += line_count
+        self._entries[lines[start]] = (tuple(lines[start + 1:start + line_count]), tokens)
+        self._entries.move_to_end(lines[start])
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        return tokens, line_count
+
+    def _measure_indent(self, line):
+        column = 0
+        pos = 0
+        for char in line:
+            if char == " ":
+                column += 1
+            elif char == "\t":
+                column = (column // self.TAB_SIZE + 1) * self.TAB_SIZE
+            elif char == "\f":
+                column = 0
+            else:
+                break
+            pos += 1
+        return column, pos
+
+    def generate_tokens(self, file_contents):
+        """ A drop in replacement for tokenize.generate_tokens over the whole file """
+        lines = StringIO(file_contents).readlines()
+        indents = [ 0 ]
+        start = 0
+        while start < len(lines):
+            tokens, line_count = self._get_logical_line(lines, start)
+            row = start + 1
+
+            #Blank and comment lines don't affect the indentation
+            line = lines[start]
+            column, pos = self._measure_indent(line)
+            if pos < len(line) and line[pos] not in "#\r\n":
+                if column > indents[-1]:
+                    indents.append(column)
+                    yield (tokenize.INDENT, line[:pos], (row, 0), (row, pos), line)
+                while column < indents[-1]:
+                    if column not in indents:
+                        raise IndentationError(
+                            "unindent does not match any outer indentation level",
+                            ("<tokenize>", row, pos, line))
+                    indents.pop()
+                    yield (DEDENT, "", (row, pos), (row, pos), line)
+
+            for tok_type, token, (srow, scol), (erow, ecol), line in tokens:
+                yield (tok_type, token, (srow + row, scol), (erow + row, ecol), line)
+
+            start += line_count
+
+        #tokenize stops on a final line of only whitespace without reading past it
+        end_row = len(lines) + 1
+        if lines and not lines[-1].strip(" \t\f"):
+            end_row = len(lines)
+
+        for indent in indents[1:]:
+            yield (DEDENT, "", (end_row, 0), (end_row, 0), "")
+        yield (tokenize.ENDMARKER, "", (end_row, 0), (end_row, 0), "")
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "hit_rate" : float(self.hits) / lookups if lookups else 0.0,
+            "size" : len(self._entries)
+        }
+
 class FileParser(object):
-    def __init__(self, file_contents, current_line=None):
+    def __init__(self, file_contents, current_line=None, token_cache=None, class_resolver=None):
         self._line_no = 0
+        self._token_cache = token_cache
+        self._class_resolver = class_resolver
+        self._classes = {}
+        self._class_scopes = []
+        self._imports = {}
         self._global = Scope("__global__", ScopeType.MODULE)
         self._current_scope = self._global
         self._current_line = current_line
         self._active_scope = self.get_global_scope()
+        self._info_cache = {}
         self._do_parse(file_contents)
 
     def _parse_to_end(self):
@@ -190,30 +400,62 @@ class FileParser(object):
             if tok_type == NEWLINE or token == "\n":
                 break;
         return tokens
+
+    def _parse_to_closing_bracket(self):
+        """ Like _parse_to_end, but keeps going over lines until the open brackets are closed """
+        tokens = self._parse_to_end()
+        while len([ x for x in tokens if x[1] in ("(", "[", "{") ]) > len([ x for x in tokens if x[1] in (")", "]", "}") ]):
+            tokens += self._parse_to_end()
+        return [ x for x in tokens if x[0] != tokenize.NL ]
     
     def _parse_class(self):
         tok_type, token, line = self._get_next_token()
         
         class_name = token
         class_scope = Scope(token, ScopeType.CLASS, parent=self._current_scope)
+        class_scope.line_no = self._line_no
         self._current_scope.types.add(class_name) #Store this class as a type
         self._current_scope.children[class_name] = class_scope
         self._current_scope = class_scope
+        #Index by dotted path, so nested classes can't hide top level ones
+        self._classes[self._describe_scope(class_scope)] = class_scope
+        self._class_scopes.append(class_scope)
         #print("New scope: %s at line %s" % (self._current_scope.name, self._line_no))
-        tokens = self._parse_to_end()
+        tokens = self._parse_to_closing_bracket()
 
         #We have an open bracket, this means the class has parents
         if tokens and tokens[0][1] == "(":
-            tokens = tokens[1:]
-            for tok_type, token in tokens[:]: 
-                if tokens[0][1] == ":": 
-                    break
-                
+            depth = 0
+            base_name = ""
+            while tokens:
+                tok_type, token = tokens[0]
                 tokens = tokens[1:]
-                if token == ")": break
-                if token == ",": continue
-                
-                self._current_scope.inherited_scopes.add(token)
+
+                if token in ("(", "[", "{"):
+                    depth += 1
+                    if depth == 1:
+                        continue
+                    elif depth == 2 and token == "(" and base_name:
+                        base_name = None #A call such as namedtuple(...), its result is unknown
+                elif token in (")", "]", "}"):
+                    depth -= 1
+                    if depth == 0:
+                        break
+                    continue #Keep Base of Base[int]
+
+                if depth != 1:
+                    continue
+                elif token == ",":
+                    if base_name:
+                        class_scope.base_names.append(base_name)
+                    base_name = ""
+                elif token == "=":
+                    base_name = None #A keyword argument such as metaclass=
+                elif base_name is not None:
+                    base_name += token
+
+            if base_name:
+                class_scope.base_names.append(base_name)
 
         #If at this point tokens[0] is a colon, we need to check and see if there are any other statements
         #after it, if so, we need to dedent
@@ -229,6 +471,7 @@ class FileParser(object):
         method_name = token
         
         method_scope = Scope(token, ScopeType.METHOD, parent=self._current_scope)
+        method_scope.line_no = self._line_no
             
         self._current_scope.methods.add(method_name) #Store this class as a type        
         self._current_scope.children[method_name] = method_scope
@@ -236,7 +479,8 @@ class FileParser(object):
         
         #print("New scope: %s at line %s" % (self._current_scope.name, self._line_no))
 
-        tokens = self._parse_to_end()
+        tokens = self._parse_to_closing_bracket()
+        method_scope.arguments = self._split_arguments(tokens)
         
         tokens = [ x for x in tokens if x[1] not in ("(", ",", ")", ":") ]
 
@@ -264,25 +508,65 @@ class FileParser(object):
             self._current_scope.children[token] = ObjectScope(parent=self._current_scope)
             self._current_scope.variables.add(token)
 
-    def _parse_with(self):
-        while True:
-            tok_type, token_str, line = self._get_next_token()
-            if tok_type == NEWLINE:
-                break
-                
-            #If we find the "as" token, we know the next token is the variable name
-            if token_str == "as":
-                tok_type, token_str, line = self._get_next_token()
-                if tok_type == NEWLINE:
-                    break;
-                self._current_scope.variables.add(token_str)
-                break
-        
-        self._parse_to_end()
+    def _split_arguments(self, tokens):
+        """ Returns the text of each top level argument between the brackets of a def """
+        arguments = []
+        current = []
+        depth = 0
+        for tok_type, token in tokens:
+            if token in ("(", "[", "{"):
+                depth += 1
+                if depth == 1:
+                    continue
+            elif token in (")", "]", "}"):
+                depth -= 1
+                if depth == 0:
+                    break
+            elif token == "," and depth == 1:
+                arguments.append("".join(current))
+                current = []
+                continue
+
+            if depth:
+                current.append(token)
+
+        if current:
+            arguments.append("".join(current))
+        return arguments
+
+    def _parse_with(self, tokens):
+        #The token after each "as" is the name of a variable
+        for i, (tok_type, token_str) in enumerate(tokens[:-1]):
+            if token_str == "as" and tokens[i + 1][0] == tokenize.NAME:
+                self._current_scope.variables.add(tokens[i + 1][1])
 
 
     def _parse_from_import(self):
-        pass
+        tokens = self._parse_to_end()
+        #Keep going until the brackets of a multi-line import are closed
+        while [ x[1] for x in tokens ].count("(") > [ x[1] for x in tokens ].count(")"):
+            tokens += self._parse_to_end()
+
+        names = [ x[1] for x in tokens if x[1] not in ("(", ")", ",") and x[1].strip() ]
+        if "import" not in names:
+            return
+
+        module = "".join(names[:names.index("import")])
+        names = names[names.index("import") + 1:]
+        while names:
+            name = alias = names[0]
+            if len(names) > 2 and names[1] == "as":
+                alias = names[2]
+                names = names[3:]
+            else:
+                names = names[1:]
+
+            if name == "*":
+                continue
+
+            self._current_scope.modules.add(alias)
+            self._current_scope.children[alias] = ObjectScope(parent=self._current_scope)
+            self._imports[alias] = (module, name)
         
     def _parse_import(self):
         tokens = self._parse_to_end()
@@ -374,6 +658,9 @@ class FileParser(object):
         return current
     
     def _dedent(self):
+        if not self._dedent_stack:
+            return
+
         to_dedent = self._dedent_stack.pop()
         
         if to_dedent:
@@ -402,8 +689,11 @@ class FileParser(object):
         return tok_type, token, line
     
     def _do_parse(self, file_contents):
-        buf = StringIO(file_contents)
-        self._gen = tokenize.generate_tokens(buf.readline)
+        if self._token_cache:
+            self._gen = self._token_cache.generate_tokens(file_contents)
+        else:
+            buf = StringIO(file_contents)
+            self._gen = tokenize.generate_tokens(buf.readline)
         
         in_block_without_scope = 0
         self._line_no = 0
@@ -436,6 +726,8 @@ class FileParser(object):
                     self._parse_import()
                 elif token in KEYWORDS_THAT_INHERIT_SCOPE:                   
                     tokens = self._parse_to_end()
+                    if token == "with":
+                        self._parse_with(tokens)
                     token_types = [x[0] for x in tokens ]
                     block_finished = False
                     if tokenize.COLON in token_types:
@@ -458,6 +750,116 @@ class FileParser(object):
 
             except StopIteration:
                 break
+
+        self._resolve_classes()
+
+    def _find_enclosing_class(self, class_scope, name):
+        """
+            Look a bare name up from where the class statement is, outward.
+            Like Python, the body of an enclosing class is only searched when
+            the class statement is directly inside it.
+        """
+        scope = class_scope.parent
+        while scope:
+            if scope is class_scope.parent or scope.scope_type != ScopeType.CLASS:
+                child = scope.children.get(name)
+                if child is not None and child is not class_scope and child.name == name and child in self._class_scopes:
+                    return child
+            scope = scope.parent
+        return None
+
+    def _resolve_base(self, class_scope, base_name):
+        if "." in base_name:
+            scope = self._classes.get(base_name)
+        else:
+            scope = self._find_enclosing_class(class_scope, base_name)
+        if scope and scope is not class_scope:
+            return scope
+
+        module = None
+        name = base_name
+        if base_name in self._imports:
+            module, name = self._imports[base_name]
+        elif "." in base_name:
+            module, name = base_name.rsplit(".", 1)
+
+        if module is not None and self._class_resolver:
+            scope = self._class_resolver(module, name)
+            if scope:
+                return scope
+
+        if base_name in BUILTIN_CLASS_SCOPES:
+            return BUILTIN_CLASS_SCOPES[base_name](class_scope)
+
+        return None
+
+    def _merge(self, sequences):
+        """ The merge step of the C3 linearization """
+        sequences = [ x for x in sequences if x ]
+        positions = [ 0 ] * len(sequences)
+
+        #Count how many sequences have each scope after their head, so
+        #picking a head doesn't mean searching every sequence
+        in_tail = {}
+        for sequence in sequences:
+            for scope in sequence[1:]:
+                in_tail[scope] = in_tail.get(scope, 0) + 1
+
+        result = []
+        merged = set()
+        while True:
+            heads = [ x[i] for x, i in zip(sequences, positions) if i < len(x) ]
+            if not heads:
+                break
+
+            for head in heads:
+                if not in_tail.get(head):
+                    break
+            else:
+                #Python would reject this hierarchy, just take the first base
+                head = heads[0]
+
+            result.append(head)
+            merged.add(head)
+            for i, sequence in enumerate(sequences):
+                while positions[i] < len(sequence) and sequence[positions[i]] in merged:
+                    positions[i] += 1
+                    if positions[i] < len(sequence):
+                        in_tail[sequence[positions[i]]] -= 1
+        return result
+
+    def _linearize(self, scope, visiting):
+        if scope.mro is not None:
+            return scope.mro
+
+        visiting.add(scope)
+        bases = [ x for x in scope.bases if x not in visiting ] #Ignore inheritance cycles
+        sequences = []
+        for base in bases:
+            if base.mro is None and base in self._class_scopes:
+                sequences.append(list(self._linearize(base, visiting)))
+            else:
+                sequences.append(list(base.get_mro()))
+        sequences.append(list(bases))
+        visiting.discard(scope)
+
+        scope.mro = [ scope ] + self._merge(sequences)
+        return scope.mro
+
+    def _resolve_classes(self):
+        """
+            Resolve the base classes of every class through the class index
+            and cache the MRO on each class scope, so member lookups don't
+            need to search for base classes again
+        """
+        for scope in self._class_scopes:
+            scope.bases = [ x for x in [ self._resolve_base(scope, y) for y in scope.base_names ] if x ]
+
+        for scope in self._class_scopes:
+            self._linearize(scope, set())
+
+    def get_class(self, name):
+        return self._classes.get(name)
         
     def get_global_scope(self):
         return self._global
@@ -465,20 +867,194 @@ class FileParser(object):
     def get_active_scope(self):
         return self._active_scope or self.get_global_scope()
 
+    def get_identifiers(self):
+        """ Returns every name defined in the file, excluding builtins """
+        names = set()
+        pending = [ self._global ]
+        while pending:
+            scope = pending.pop()
+            names.update(scope.variables, scope.methods, scope.types, scope.modules)
+            #Only follow scopes created by this parse, not "self" or the builtin type scopes
+            pending.extend([ x for x in scope.children.values() if type(x) is Scope and x.parent is scope ])
+
+        return set([ x for x in names if x.isidentifier() and x not in BUILTIN_NAMES ])
+
+    def _describe_scope(self, scope):
+        if scope.scope_type == ScopeType.MODULE:
+            return "module"
+
+        path = []
+        while scope and scope.scope_type != ScopeType.MODULE:
+            path.insert(0, scope.name)
+            scope = scope.parent
+
+        return ".".join(path)
+
+    def _describe(self, scope, name, search_parents):
+        """ Works out what name is from the scope it was completed in """
+        while scope:
+            candidates = [ scope ] + [ x for x in scope.inherited_scopes if isinstance(x, Scope) ]
+            candidates += scope.get_mro()[1:]
+            for candidate in candidates:
+                child = candidate.children.get(name)
+                defined_here = child is not None and child.parent is candidate and child.line_no is not None
+                is_builtin = candidate.scope_type == ScopeType.MODULE and not defined_here
+
+                if name in candidate.types:
+                    kind = "builtin type" if is_builtin else "class"
+                elif name in candidate.methods:
+                    if is_builtin:
+                        kind = "builtin function"
+                    elif candidate.scope_type == ScopeType.CLASS:
+                        kind = "method"
+                    else:
+                        kind = "function"
+                elif name in candidate.modules:
+                    kind = "module"
+                elif name in candidate.variables:
+                    kind = "variable"
+                elif name in candidate.keywords:
+                    kind = "keyword"
+                else:
+                    continue
+
+                if kind in ("keyword", "builtin type", "builtin function"):
+                    return "%s %s" % (kind, name)
+
+                title = name
+                if defined_here and child.scope_type == ScopeType.METHOD:
+                    title = "%s(%s)" % (name, ", ".join(child.arguments))
+
+                location = "defined in %s" % self._describe_scope(candidate)
+                if defined_here:
+                    location += ", line %s" % (child.line_no + 1)
+
+                return "%s %s\n%s" % (kind, title, location)
+
+            if not search_parents:
+                break
+            scope = scope.parent
+
+        return None
+
+    def get_info(self, scope, name, search_parents=True):
+        """
+            Returns a description of name as seen from scope. This is only
+            called for the proposal the user selects so the result is
+            cached for the lifetime of the parse rather than built upfront.
+        """
+        key = (id(scope), name, search_parents)
+        if key not in self._info_cache:
+            self._info_cache[key] = self._describe(scope, name, search_parents)
+        return self._info_cache[key]
+
+class TriggerPolicy(object):
+    """
+        Decides from the text around the cursor whether a completion
+        request should be answered, and whether the buffer should be
+        parsed again for it or answered from the last parse. Requests
+        made explicitly by the user always go through.
+    """
+    def __init__(self, min_prefix_length=2, complete_after_dot=True, min_interval=0.25,
+                 suppress_in_strings=True, suppress_in_comments=True):
+        self.min_prefix_length = min_prefix_length
+        self.complete_after_dot = complete_after_dot
+        self.min_interval = min_interval
+        self.suppress_in_strings = suppress_in_strings
+        self.suppress_in_comments = suppress_in_comments
+        self._last_parse = {}
+
+    def _after_dot(self, prefix):
+        return self.complete_after_dot and prefix.endswith(".")
+
+    def should_complete(self, prefix, in_string=False, in_comment=False, user_requested=False):
+        if user_requested:
+            return True
+
+        if in_string and self.suppress_in_strings:
+            return False
+        if in_comment and self.suppress_in_comments:
+            return False
+
+        #Numeric literals never have completions
+        if not prefix or prefix[0].isdigit():
+            return False
+
+        if not self._after_dot(prefix) and len(prefix.split(".")[-1]) < self.min_prefix_length:
+            return False
+
+        return True
+
+    def should_parse(self, document, prefix, user_requested=False, now=None):
+        """
+            Limits how often a document is parsed while the user is typing.
+            Within min_interval of the last parse, the request should be
+            answered from that parse instead.
+        """
+        if now is None:
+            now = time.time()
+
+        last_parse = self._last_parse.get(document)
+        if not user_requested and not self._after_dot(prefix):
+            if last_parse is not None and now - last_parse < self.min_interval:
+                return False
+
+        self._last_parse[document] = now
+        return True
+
+    def forget(self, document):
+        self._last_parse.pop(document, None)
+
 class Completer(object):
     def __init__(self):
         self._parsers = {}
         self._active_parser = None
+        self._index = IdentifierIndex()
+        self._token_cache = TokenCache()
+        self._completion_scope = None
+        self._completion_scope_is_member = False
         
     def parse_file(self, name, file_content, line):
         try:
-            parser = FileParser(file_content, current_line=line)
+            parser = FileParser(file_content, current_line=line, token_cache=self._token_cache,
+                                class_resolver=lambda module, class_name: self._find_class(module, class_name, name))
         except (IndentationError, tokenize.TokenError):
             pass
         else:
             self._parsers[name] = parser
+            self._index.update(name, parser.get_identifiers())
         if name in self._parsers:
             self._active_parser = name
+
+    def _find_class(self, module, class_name, exclude):
+        """
+            Look up a class imported from another open document. Only the
+            document the module path points at is used, a class with the
+            same name somewhere else is a different class.
+        """
+        module_path = module.lstrip(".").replace(".", "/")
+        if not module_path:
+            return None
+
+        for document in sorted(self._parsers):
+            path = "/" + document.replace(os.sep, "/")
+            if document != exclude and (path.endswith("/" + module_path + ".py") or path.endswith("/" + module_path + "/__init__.py")):
+                return self._parsers[document].get_class(class_name)
+        return None
+
+    def select_file(self, name):
+        """ Make the last successful parse of a document the active one, without parsing again """
+        if name not in self._parsers:
+            return False
+        self._active_parser = name
+        return True
+
+    def forget_file(self, name):
+        """ Drop a document that has been closed """
+        self._parsers.pop(name, None)
+        self._index.remove(name)
+        if self._active_parser == name:
+            self._active_parser = None
     
     def get_completions(self, match):
         """
@@ -492,6 +1068,8 @@ class Completer(object):
             
         parser = self._parsers[self._active_parser]
         scope_at_line = parser.get_active_scope()
+        self._completion_scope = scope_at_line
+        self._completion_scope_is_member = False
         
         parts = match.split(".")
         all_possible = set()
@@ -522,6 +1100,8 @@ class Completer(object):
         for part in parts:        
             if part in all_possible and part in scope_at_line.children:
                 scope_at_line = scope_at_line.children[part]
+                self._completion_scope = scope_at_line
+                self._completion_scope_is_member = True
                 #print("Looking at scope: " + scope_at_line.name)
                 matches = []
                 
@@ -538,14 +1118,52 @@ class Completer(object):
                     if possible.startswith(part):
                         matches.append(possible)
                 break
+
+        if not matches and len(parts) == 1 and parts[0]:
+            #Nothing in scope, fall back to names defined in the other open documents.
+            #Only for bare names, they aren't known to be attributes of anything
+            return self._index.find(parts[-1], exclude=self._active_parser)
                         
         return sorted(list(set(matches)))
 
+    def get_stats(self):
+        return {
+            "token_cache" : self._token_cache.get_stats()
+        }
+
+    def get_info(self, name):
+        """
+            Describe a proposal returned by the last call to get_completions
+        """
+        if not self._active_parser or not self._completion_scope:
+            return None
+
+        parser = self._parsers[self._active_parser]
+        info = parser.get_info(self._completion_scope, name, not self._completion_scope_is_member)
+        if info:
+            return info
+
+        documents = self._index.get_documents(name) - set([self._active_parser])
+        if documents:
+            return "%s\ndefined in %s" % (name, ", ".join(sorted(documents)))
+        return None
+
 c = Completer()
-def complete(file_content, match, line):
-    c.parse_file("test", file_content, line)
+def complete(file_content, match, line, name="test"):
+    c.parse_file(name, file_content, line)
     return [ { 'abbr' : x } for x in c.get_completions(match) ]
 
+def complete_from_last_parse(match, name="test"):
+    if not c.select_file(name):
+        return None
+    return [ { 'abbr' : x } for x in c.get_completions(match) ]
+
+def get_info(name):
+    return c.get_info(name)
+
+def forget(name):
+    c.forget_file(name)
+
 if __name__ == '__main__':
     sample = """
     class A(object):
@@ -596,6 +1214,172 @@ if __name__ == '__main__':
     matches = complete(sample, "self.", 6)
     #print("Matches are: %s" % matches)
 
+    assert get_info("public") == "method public(self, other)\ndefined in A, line 12"
+    assert get_info("class_var") == "variable class_var\ndefined in A"
+
+    complete(sample, "ma", 25)
+    assert get_info("main") == "function main()\ndefined in module, line 39"
+    assert get_info("A") == "class A\ndefined in module, line 2"
+    assert get_info("map") == "builtin type map"
+    assert get_info("max") == "builtin function max"
+
+    complete("def spread(a,\n           b=1):\n    pass\nx = 1\n", "sp", 3, name="spread.py")
+    assert get_info("spread") == "function spread(a, b=1)\ndefined in module, line 1"
+    assert "x" in c._parsers["spread.py"].get_global_scope().variables
+    forget("spread.py")
+
+    other = """
+class OtherClass(object):
+    def other_method(self):
+        pass
+"""
+    complete(other, "", 0, name="other.py")
+    assert complete(sample, "other_", 25) == [ { 'abbr' : "other_method" } ]
+    assert get_info("other_method") == "other_method\ndefined in other.py"
+    assert complete(sample, "self.other_", 12) == []
+    assert complete(sample, "os.other_", 12) == []
+    assert complete(sample, "ma", 25) == [ { 'abbr' : x } for x in ("main", "map", "max") ]
+    forget("other.py")
+    assert complete(sample, "other_", 25) == []
+
+    #Only the edited line should need tokenizing again
+    stats = c.get_stats()["token_cache"]
+    complete(sample.replace("g = 1", "g = 2"), "se", 6)
+    assert c.get_stats()["token_cache"]["misses"] == stats["misses"] + 1
+    assert c.get_stats()["token_cache"]["hit_rate"] > stats["hit_rate"]
+
+    hierarchy = """
+from base import Imported
+
+class Base(object):
+    def base_method(self):
+        self.base_var = 1
+
+class Left(Base):
+    def left_method(self):
+        pass
+
+class Right(Base):
+    def right_method(self):
+        pass
+
+class Child(Left, Right, metaclass=Meta):
+    class Inner(dict):
+        pass
+
+    def child_method(self):
+        pass
+
+class Other(Child.Inner, Imported):
+    pass
+
+class Loop(Loop):
+    pass
+
+class Holder(object):
+    class Base(object):
+        def holder_only(self):
+            pass
+
+    class Nested(Base):
+        pass
+
+class Late(Base):
+    pass
+
+class Generic(Left[int], Right):
+    pass
+
+class Made(mk(Base)):
+    pass
+
+class Multi(
+        Left,
+        Right):
+    def multi_method(self):
+        pass
+
+class Outer(object):
+    class Base(object):
+        pass
+
+    def method(self):
+        class Local(Base):
+            pass
+
+from django.db.models import Model
+from pkg.mod import Packaged
+
+class Row(Model, Packaged):
+    pass
+"""
+    complete("class Imported(object):\n    def imported_method(self):\n        pass\n", "", 0, name="/tmp/base.py")
+    complete("class Model(object):\n    pass\n", "", 0, name="/tmp/unrelated.py")
+    complete("class Packaged(object):\n    pass\n", "", 0, name="/tmp/pkg/mod/__init__.py")
+    assert complete(hierarchy, "self.", 20) == [ { 'abbr' : x } for x in ("Inner", "base_method", "base_var", "child_method", "left_method", "right_method") ]
+    assert get_info("base_method") == "method base_method(self)\ndefined in Base, line 5"
+
+    parser = FileParser(hierarchy, class_resolver=lambda module, name: c._find_class(module, name, None))
+    assert [ x.name for x in parser.get_class("Child").get_mro() ] == [ "Child", "Left", "Right", "Base" ]
+    assert [ x.name for x in parser.get_class("Other").get_mro() ] == [ "Other", "Inner", "dict", "Imported" ]
+    assert "imported_method" in parser.get_class("Other").get_methods()
+    assert "keys" in parser.get_class("Other").get_methods()
+    assert [ x.name for x in parser.get_class("Loop").get_mro() ] == [ "Loop" ]
+
+    #A nested class doesn't hide a top level class with the same name
+    assert parser.get_class("Child").get_mro()[-1] is parser.get_class("Base")
+    assert parser.get_class("Late").get_mro() == [ parser.get_class("Late"), parser.get_class("Base") ]
+    assert "base_method" in parser.get_class("Late").get_methods()
+    assert "holder_only" not in parser.get_class("Late").get_methods()
+    assert parser.get_class("Holder.Nested").get_mro()[1] is parser.get_class("Holder.Base")
+    assert "holder_only" in parser.get_class("Holder.Nested").get_methods()
+
+    #A subscripted base is the class it subscripts, a call is unknown
+    assert parser.get_class("Generic").base_names == [ "Left", "Right" ]
+    assert [ x.name for x in parser.get_class("Generic").get_mro() ] == [ "Generic", "Left", "Right", "Base" ]
+    assert parser.get_class("Made").base_names == []
+
+    assert parser.get_class("Multi").base_names == [ "Left", "Right" ]
+    assert [ x.name for x in parser.get_class("Multi").get_mro() ] == [ "Multi", "Left", "Right", "Base" ]
+    assert parser.get_class("Multi").methods == set([ "multi_method" ])
+
+    #A class inside a method can't see the body of the class around the method
+    assert parser.get_class("Outer.method.Local").get_mro()[1] is parser.get_class("Base")
+
+    #Imported classes only come from the document the module points at
+    assert [ x.name for x in parser.get_class("Row").get_mro() ] == [ "Row", "Packaged" ]
+    forget("/tmp/base.py")
+    forget("/tmp/unrelated.py")
+    forget("/tmp/pkg/mod/__init__.py")
+
+    policy = TriggerPolicy(min_prefix_length=2, min_interval=0.5)
+    assert not policy.should_complete("s")
+    assert policy.should_complete("se")
+    assert policy.should_complete("self.")
+    assert policy.should_complete("s", user_requested=True)
+    assert not policy.should_complete("12")
+    assert not policy.should_complete("se", in_string=True)
+    assert not policy.should_complete("se", in_comment=True)
+
+    #Typing faster than the interval answers from the last parse instead of dropping the request
+    assert policy.should_parse("test", "se", now=10.0)
+    assert not policy.should_parse("test", "sel", now=10.2)
+    assert not policy.should_parse("test", "self", now=10.4)
+    assert policy.should_parse("test", "self.", now=10.45)
+    assert policy.should_parse("other", "se", now=10.45)
+    assert policy.should_parse("test", "self.v", user_requested=True, now=10.5)
+    assert not policy.should_parse("test", "self.va", now=10.6)
+    assert policy.should_parse("test", "self.var", now=11.1)
+
+    complete(sample, "se", 12)
+    assert complete_from_last_parse("self.pu") == [ { 'abbr' : "public" } ]
+    assert complete_from_last_parse("se", name="unknown.py") is None
+
+    cache = TokenCache()
+    for source in (sample, "x = (1,\n  2)\nif x:\n\ty = '''a\nb'''\n    # comment\n", "x = 1\n    "):
+        assert list(cache.generate_tokens(source)) == list(tokenize.generate_tokens(StringIO(source).readline))
+        assert list(cache.generate_tokens(source)) == list(tokenize.generate_tokens(StringIO(source).readline))
+
     parser = FileParser(sample)
     global_scope = parser.get_global_scope()
     
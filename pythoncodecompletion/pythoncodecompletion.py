@@ -17,8 +17,16 @@
 # Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
 from gi.repository import GObject, Gedit, Gtk, GtkSource
+import itertools
+import os
 import re
-from .code_complete import complete
+import time
+from .code_complete import complete, complete_from_last_parse, get_info, forget, TriggerPolicy
+from .session import SessionRecorder
+
+#Set to a directory to record anonymized editing sessions for session.py to replay
+RECORD_DIR = os.environ.get("GEDIT_PYTHON_COMPLETION_RECORD_DIR")
+_session_ids = itertools.count()
 
 class PythonCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
     __gtype_name__ = 'PythonCompletionProvider'
@@ -26,18 +34,62 @@ class PythonCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
     re_alpha = re.compile("\w+", re.UNICODE | re.MULTILINE)
     re_non_alpha = re.compile("\W+", re.UNICODE | re.MULTILINE)
 
-    def __init__(self, view):
+    def __init__(self, view, policy):
         GObject.Object.__init__(self)
         self._view = view
+        self._policy = policy
         theme = Gtk.IconTheme.get_default()
         self._info_icon = theme.load_icon(Gtk.STOCK_DIALOG_INFO, 16, 0)
+        self._info_widget = None
+        self._recorder = None
+        self._record_handlers = []
+        if RECORD_DIR:
+            self._start_recording()
+
+        #Documents are known to the completer by name, which changes on Save As
+        doc = self._view.get_buffer()
+        self._document_name = doc.get_uri_for_display()
+        self._location_handler = doc.connect("notify::location", self.on_location_changed)
+
+    def on_location_changed(self, doc, pspec):
+        forget(self._document_name)
+        self._policy.forget(self._document_name)
+        self._document_name = doc.get_uri_for_display()
+
+    def shutdown(self):
+        self._view.get_buffer().disconnect(self._location_handler)
+        self.stop_recording()
+
+    def _start_recording(self):
+        doc = self._view.get_buffer()
+        path = os.path.join(RECORD_DIR, "session-%d-%d.jsonl" % (time.time(), next(_session_ids)))
+        self._recorder = SessionRecorder(path, doc.get_text(*(list(doc.get_bounds()) + [True])))
+        self._record_handlers = [
+            doc.connect("insert-text", self.on_insert_text),
+            doc.connect("delete-range", self.on_delete_range)
+        ]
+
+    def stop_recording(self):
+        if not self._recorder:
+            return
+
+        doc = self._view.get_buffer()
+        for handler_id in self._record_handlers:
+            doc.disconnect(handler_id)
+        self._record_handlers = []
+        self._recorder.save()
+        self._recorder = None
+
+    def on_insert_text(self, doc, location, text, length):
+        self._recorder.insert(location.get_offset(), text)
+
+    def on_delete_range(self, doc, start, end):
+        self._recorder.delete(start.get_offset(), end.get_offset() - start.get_offset())
 
     def do_get_name(self):
         return _("Python Code Completion provider")
 
-    def _get_proposals(self, context):
-        doc = self._view.get_buffer()
-        insert = context.get_iter()
+    def _get_incomplete(self, insert):
         start = insert.copy()
 
         while start.backward_char():
@@ -46,7 +98,13 @@ class PythonCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
                 start.forward_char()
                 break
 
-        incomplete = doc.get_text(start, insert, True)
+        return insert.get_buffer().get_text(start, insert, True)
+
+    def _get_proposals(self, context):
+        doc = self._view.get_buffer()
+        insert = context.get_iter()
+
+        incomplete = self._get_incomplete(insert)
         if not incomplete:
             return []
         
@@ -56,8 +114,15 @@ class PythonCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
             return []
             
         line = insert.get_line()
+        name = doc.get_uri_for_display()
+        user_requested = context.get_activation() == GtkSource.CompletionActivation.USER_REQUESTED
         #print("... on line: %s" % line)
-        completes = complete( doc.get_text(*(list(doc.get_bounds()) + [True])), incomplete, line)
+        completes = None
+        if not self._policy.should_parse(name, incomplete, user_requested):
+            #Typing faster than the parse interval, answer from the last parse of this document
+            completes = complete_from_last_parse(incomplete, name)
+        if completes is None:
+            completes = complete( doc.get_text(*(list(doc.get_bounds()) + [True])), incomplete, line, name)
         if not completes:
             return []
             
@@ -74,7 +139,8 @@ class PythonCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
         for x in completes:
             x['completion'] = x['abbr'][length:]
             
-            result.append(GtkSource.CompletionItem.new(x['abbr'], x['abbr'], self._info_icon, x['abbr']))
+            #The info text is filled in by do_update_info when the proposal is selected
+            result.append(GtkSource.CompletionItem.new(x['abbr'], x['abbr'], self._info_icon, None))
 
         return result
     
@@ -83,8 +149,38 @@ class PythonCompletionProvider(GObject.Object, GtkSource.CompletionProvider):
         proposals = self._get_proposals(context)
         context.add_proposals(self, proposals, True)
         
+    def do_get_info_widget(self, proposal):
+        if not self._info_widget:
+            self._info_widget = Gtk.Label()
+            self._info_widget.set_alignment(0, 0.5)
+            self._info_widget.show()
+        return self._info_widget
+
+    def do_update_info(self, proposal, info):
+        text = get_info(proposal.get_label()) or proposal.get_label()
+        self._info_widget.set_text(text)
+
     def do_match(self, context):
-        return context.get_iter().get_buffer().get_mime_type() == 'text/x-python'
+        insert = context.get_iter()
+        doc = insert.get_buffer()
+        if doc.get_mime_type() != 'text/x-python':
+            return False
+
+        #Decide from the text around the cursor before the whole buffer is fetched
+        incomplete = self._get_incomplete(insert)
+        in_string = doc.iter_has_context_class(insert, "string")
+        in_comment = doc.iter_has_context_class(insert, "comment")
+        user_requested = context.get_activation() == GtkSource.CompletionActivation.USER_REQUESTED
+
+        if self._recorder:
+            self._recorder.request(insert.get_line(), incomplete, in_string, in_comment, user_requested)
+
+        return self._policy.should_complete(
+            incomplete,
+            in_string=in_string,
+            in_comment=in_comment,
+            user_requested=user_requested
+        )
 
     def do_get_priority(self):
         #print("get_priority")
@@ -108,13 +204,15 @@ class CompletionPlugin(GObject.Object, Gedit.WindowActivatable):
         self.completions = None
         self.name = "CompletionPlugin"
         self._providers = {}
+        self._policy = TriggerPolicy()
 
     def _add_provider(self, view):
-        self._providers[view] = PythonCompletionProvider(view)
+        self._providers[view] = PythonCompletionProvider(view, self._policy)
         view.get_completion().add_provider(self._providers[view])
         
     def _remove_provider(self, view):
         view.get_completion().remove_provider(self._providers[view])        
+        self._providers[view].shutdown()
         del self._providers[view]
     
     def do_activate(self):
@@ -142,12 +240,17 @@ class CompletionPlugin(GObject.Object, Gedit.WindowActivatable):
             self.window.disconnect(handler_id)
         self._handlers = None
 
+        for provider in self._providers.values():
+            provider.shutdown()
+
     def on_tab_added(self, window, tab, data=None):
         """Connect the document and view in tab."""
         self._add_provider(tab.get_view())
 
     def on_tab_removed(self, window, tab, data=None):
         self._remove_provider(tab.get_view())
+        forget(tab.get_document().get_uri_for_display())
+        self._policy.forget(tab.get_document().get_uri_for_display())
         
 
         
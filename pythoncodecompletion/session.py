@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2011 Luke Benstead
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+""" Recording of editing sessions, and a headless harness to replay them """
+
+import argparse
+import builtins
+import json
+import keyword
+import os
+import random
+import re
+import string
+import sys
+import tempfile
+import time
+import tokenize
+from io import StringIO
+
+try:
+    from .code_complete import Completer, TriggerPolicy
+except ImportError:
+    #Run as a script, outside of the plugin package
+    from code_complete import Completer, TriggerPolicy
+
+#Keywords and builtins are kept so the parser sees the same structure, as
+#are self and cls which it treats specially
+KEPT_WORDS = set(keyword.kwlist) | set(getattr(keyword, "softkwlist", [])) | set(dir(builtins)) | set([ "self", "cls" ])
+
+class Anonymizer(object):
+    """
+        Replaces every identifier that isn't kept with a random name of the
+        same length, and the contents of strings and comments with filler.
+        Numbers and string prefixes are left alone. Lengths are preserved so
+        offsets into the anonymized text are the same as offsets into the
+        real one.
+
+        Names are replaced a character at a time, the replacement depending
+        on the characters before it, so a prefix of a name is replaced with
+        a prefix of its replacement and a partly typed word still completes
+        to the same names. Kept words are replaced with themselves, so no
+        other name can be replaced with one.
+    """
+    re_token = re.compile(r"""
+        (?P<comment>\#[^\r\n]*)
+      | (?P<prefix>[rRbBuUfF]{0,2})(?P<string>
+            '{3}[\s\S]*?(?:'{3}|\Z)
+          | "{3}[\s\S]*?(?:"{3}|\Z)
+          | '(?:\\[\s\S]|[^\\'\r\n])*'?
+          | "(?:\\[\s\S]|[^\\"\r\n])*"?)
+      | (?P<number>\d[\w.]*|\.\d[\w.]*)
+      | (?P<name>[^\W\d]\w*)
+    """, re.UNICODE | re.VERBOSE)
+
+    def __init__(self, seed=None):
+        self._rng = random.Random(seed)
+        self._names = {}
+        self._chars = {} #(prefix, character) -> replacement character
+        self._taken = {} #prefix -> replacement characters used after it
+        for word in KEPT_WORDS:
+            for i, char in enumerate(word):
+                self._chars[(word[:i], char)] = char
+                self._taken.setdefault(word[:i], set()).add(char)
+
+    def _random_char(self, prefix, char):
+        if char == "_":
+            return char
+        elif char.isupper():
+            choices = string.ascii_uppercase
+        elif char.isdigit() and prefix:
+            choices = string.digits
+        else:
+            choices = string.ascii_lowercase
+
+        #Only non ascii characters can run out, sharing a character is fine then
+        taken = self._taken.get(prefix, ())
+        return self._rng.choice([ x for x in choices if x not in taken ] or choices)
+
+    def anonymize_name(self, name):
+        if name not in self._names:
+            result = []
+            for i, char in enumerate(name):
+                key = (name[:i], char)
+                if key not in self._chars:
+                    self._chars[key] = self._random_char(name[:i], char)
+                    self._taken.setdefault(name[:i], set()).add(self._chars[key])
+                result.append(self._chars[key])
+            self._names[name] = "".join(result)
+        return self._names[name]
+
+    def _fill(self, text):
+        #Backslashes and line breaks are kept so strings end on the same
+        #lines, and braces so f-strings hold the same number of fields
+        return "".join([ x if x in "\\\r\n{}" else "x" for x in text ])
+
+    def anonymize_token(self, match):
+        if match.group("comment"):
+            return "#" + self._fill(match.group("comment")[1:])
+        elif match.group("string"):
+            quoted = match.group("string")
+            quote = quoted[:3] if quoted[:3] in ("'''", '"""') else quoted[0]
+            body = quoted[len(quote):]
+            closing = quote if body.endswith(quote) and len(body) >= len(quote) else ""
+            body = body[:len(body) - len(closing)]
+            return match.group("prefix") + quote + self._fill(body) + closing
+        elif match.group("name"):
+            return self.anonymize_name(match.group("name"))
+        return match.group(0)
+
+    def anonymize(self, text):
+        return self.re_token.sub(self.anonymize_token, text)
+
+def _common_prefix_length(a, b):
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+class SessionRecorder(object):
+    """
+        Records the edits and completion requests made to a document. Each
+        event is stored with the number of seconds since recording started.
+    """
+    def __init__(self, path, text="", seed=None):
+        self._path = path
+        self._anonymizer = Anonymizer(seed)
+        self._text = text
+        self._anonymized = self._anonymizer.anonymize(text)
+        #Tokens that span lines, only a line start outside these is known
+        #to start a token
+        self._spans = [ x.span() for x in self._anonymizer.re_token.finditer(text) if "\n" in x.group(0) ]
+        self._start = time.time()
+        self._events = []
+        self._add({ "type" : "load", "text" : self._anonymized })
+
+    def _add(self, event):
+        event["time"] = round(time.time() - self._start, 4)
+        self._events.append(event)
+
+    def _token_bounds(self, text, start):
+        for match in self._anonymizer.re_token.finditer(text, start):
+            yield match.start()
+            yield match.end()
+
+    def _replace(self, offset, length, text):
+        """
+            An edit can change how the text after it is read (opening a string
+            for instance) so the text is anonymized again from the start of the
+            edited line, until a token starts or ends after the edit where one
+            did before it. From there on the text is read the same as before.
+        """
+        old_text = self._text
+        self._text = old_text[:offset] + text + old_text[offset + length:]
+        delta = len(text) - length
+        edit_end = offset + len(text)
+
+        start = old_text.rfind("\n", 0, offset) + 1
+        for span_start, span_end in self._spans:
+            if span_start < start <= span_end:
+                start = span_start
+                break
+
+        old_bounds = self._token_bounds(old_text, start)
+        old_bound = None
+
+        def in_step(bound):
+            #Whether the old text had a token start or end at the same place
+            nonlocal old_bound
+            if bound < edit_end:
+                return False
+            while old_bound is None or old_bound < bound - delta:
+                old_bound = next(old_bounds, len(old_text) + 1)
+            return old_bound == bound - delta
+
+        pieces = []
+        spans = []
+        position = start
+        stop = len(self._text)
+        for match in self._anonymizer.re_token.finditer(self._text, start):
+            if in_step(match.start()):
+                stop = match.start()
+                break
+
+            pieces.append(self._text[position:match.start()])
+            pieces.append(self._anonymizer.anonymize_token(match))
+            if "\n" in match.group(0):
+                spans.append(match.span())
+            position = match.end()
+
+            if in_step(position):
+                stop = position
+                break
+        pieces.append(self._text[position:stop])
+
+        old_stop = stop - delta
+        self._spans = [ x for x in self._spans if x[0] < start ] + spans + \
+                      [ (x + delta, y + delta) for x, y in self._spans if x >= old_stop ]
+
+        #Only record the part of the rewritten text that changed
+        old_segment = self._anonymized[start:old_stop]
+        segment = "".join(pieces)
+        self._anonymized = self._anonymized[:start] + segment + self._anonymized[old_stop:]
+
+        head = _common_prefix_length(old_segment, segment)
+        tail = min(_common_prefix_length(old_segment[::-1], segment[::-1]), min(len(old_segment), len(segment)) - head)
+        self._add({
+            "type" : "replace",
+            "offset" : start + head,
+            "length" : len(old_segment) - head - tail,
+            "text" : segment[head:len(segment) - tail]
+        })
+
+    def insert(self, offset, text):
+        self._replace(offset, 0, text)
+
+    def delete(self, offset, length):
+        self._replace(offset, length, "")
+
+    def request(self, line, prefix, in_string=False, in_comment=False, user_requested=False):
+        self._add({
+            "type" : "complete",
+            "line" : line,
+            "prefix" : self._anonymizer.anonymize(prefix),
+            "in_string" : in_string,
+            "in_comment" : in_comment,
+            "user_requested" : user_requested
+        })
+
+    def save(self):
+        with open(self._path, "w") as f:
+            for event in self._events:
+                f.write(json.dumps(event) + "\n")
+
+def load_session(path):
+    with open(path) as f:
+        return [ json.loads(x) for x in f if x.strip() ]
+
+def replay(events, completer=None, policy=None):
+    """
+        Replays a recorded session and returns the time taken by each
+        completion request to parse the document and find the completions.
+        If a policy is given, requests it rejects are skipped, and requests
+        inside its parse interval are answered from the last parse.
+    """
+    completer = completer or Completer()
+    text = ""
+    latencies = []
+    for event in events:
+        if event["type"] == "load":
+            text = event["text"]
+        elif event["type"] == "replace":
+            offset = event["offset"]
+            text = text[:offset] + event["text"] + text[offset + event["length"]:]
+        elif event["type"] == "complete":
+            if policy and not policy.should_complete(event["prefix"],
+                                                     in_string=event["in_string"],
+                                                     in_comment=event["in_comment"],
+                                                     user_requested=event["user_requested"]):
+                continue
+
+            start = time.perf_counter()
+            if policy and not policy.should_parse("session", event["prefix"],
+                                                  user_requested=event["user_requested"],
+                                                  now=event["time"]) and completer.select_file("session"):
+                completer.get_completions(event["prefix"])
+            else:
+                completer.parse_file("session", text, event["line"])
+                completer.get_completions(event["prefix"])
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    if not ordered:
+        return { "requests" : 0 }
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "requests" : len(ordered),
+        "mean" : sum(ordered) / len(ordered),
+        "p50" : percentile(0.5),
+        "p90" : percentile(0.9),
+        "p99" : percentile(0.99),
+        "max" : ordered[-1]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded editing sessions against the completer")
+    parser.add_argument("sessions", nargs="+", help="session files written by the plugin")
+    parser.add_argument("--policy", action="store_true", help="apply the default trigger policy to the requests")
+    args = parser.parse_args()
+
+    for path in args.sessions:
+        completer = Completer()
+        latencies = replay(load_session(path), completer, TriggerPolicy() if args.policy else None)
+        summary = summarize(latencies)
+        print("%s: %s requests" % (path, summary["requests"]))
+        for key in ("mean", "p50", "p90", "p99", "max"):
+            if key in summary:
+                print("    %-4s %8.2f ms" % (key, summary[key] * 1000))
+        print("    token cache hit rate %.1f%%" % (completer.get_stats()["token_cache"]["hit_rate"] * 100))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main()
+        sys.exit(0)
+
+    sample = '''
+# the password for the database is hunter2
+import os
+
+class Account(object):
+    def __init__(self, ok, fn, db, id2):
+        self.ok = ok
+        self.value_one = fn
+        self.value_two = db
+        self.total = 0x1F + 1e5 + 1_000 + .5 + 3j
+        self.raw = b"raw" + rb"\\d" + f"{ok}" + "it\\"s"
+        self.doc = """first
+        second"""
+
+    def check(self):
+        return self.ok
+'''
+    def token_types(text):
+        return [ x.type for x in tokenize.generate_tokens(StringIO(text).readline) ]
+
+    for seed in range(200):
+        anonymized = Anonymizer(seed).anonymize(sample)
+        assert len(anonymized) == len(sample)
+        assert token_types(anonymized) == token_types(sample)
+        assert "hunter2" not in anonymized and "password" not in anonymized
+        assert "Account" not in anonymized and "def check(self)" not in anonymized
+
+    #A partly typed name completes to as many names once anonymized
+    anonymizer = Anonymizer(1)
+    anonymized = anonymizer.anonymize(sample)
+    real, fake = Completer(), Completer()
+    names = set(re.findall(r"[^\W\d]\w*", sample))
+    prefixes = set([ x[:i] for x in names for i in range(1, len(x) + 1) ])
+    for line in (7, 15):
+        real.parse_file("session", sample, line)
+        fake.parse_file("session", anonymized, line)
+        for prefix in prefixes | set([ "self." + x for x in prefixes ]):
+            assert len(real.get_completions(prefix)) == len(fake.get_completions(anonymizer.anonymize(prefix))), prefix
+    assert real.get_completions("self.val") == [ "value_one", "value_two" ]
+    assert len(fake.get_completions(anonymizer.anonymize("self.val"))) == 2
+
+    #Type the sample in and check the recording replays to the same text
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    recorder = SessionRecorder(path, seed=1)
+    typed = ""
+    requests = 0
+    for i, char in enumerate(sample):
+        recorder.insert(len(typed), char)
+        typed += char
+        if i % 20 == 19:
+            recorder.delete(len(typed) - 1, 1)
+            recorder.insert(len(typed) - 1, typed[-1])
+        if char == "." or i % 15 == 0:
+            recorder.request(typed.count("\n"), re.search(r"[\w.]*$", typed).group(0))
+            requests += 1
+    recorder.save()
+
+    events = load_session(path)
+    os.remove(path)
+    text = ""
+    for event in events:
+        if event["type"] == "load":
+            text = event["text"]
+        elif event["type"] == "replace":
+            text = text[:event["offset"]] + event["text"] + text[event["offset"] + event["length"]:]
+    assert text == recorder._anonymizer.anonymize(sample)
+    assert token_types(text) == token_types(sample)
+    assert "hunter2" not in "".join([ json.dumps(x) for x in events ])
+
+    #Edits are anonymized from the edited line on, check that gives the
+    #same text as anonymizing all of it, whatever the edit opens or closes
+    rng = random.Random(0)
+    recorder = SessionRecorder(path, sample, seed=2)
+    typed = sample
+    for i in range(2000):
+        offset = rng.randint(0, len(typed))
+        if typed and rng.random() < 0.4:
+            offset = min(offset, len(typed) - 1)
+            length = rng.randint(1, min(5, len(typed) - offset))
+            recorder.delete(offset, length)
+            typed = typed[:offset] + typed[offset + length:]
+        else:
+            text = rng.choice([ "'", '"', "'" * 3, '"' * 3, "#", "\\", "\n", "x", "ab", " ", "1.5", "rb", "{" ])
+            recorder.insert(offset, text)
+            typed = typed[:offset] + text + typed[offset:]
+        assert recorder._anonymized == recorder._anonymizer.anonymize(typed)
+
+    summary = summarize(replay(events))
+    assert summary["requests"] == requests
+    assert 0 < summary["p50"] <= summary["p90"] <= summary["p99"] <= summary["max"]
+    assert summarize(replay(events, policy=TriggerPolicy()))["requests"] <= requests